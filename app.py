@@ -1,7 +1,14 @@
+import json
+import os
+import tempfile
+from importlib.util import find_spec
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # -------------------- PAGE CONFIG --------------------
 st.set_page_config(layout="wide")
@@ -9,21 +16,11 @@ st.title("NovaRetail Customer Intelligence Dashboard")
 st.subheader("Revenue Optimization and Customer Segment Analytics")
 
 # -------------------- LOAD DATA --------------------
-try:
-    df = pd.read_excel("NR_dataset.xlsx")
-except FileNotFoundError:
-    st.error("Dataset file not found in repository.")
-    st.stop()
-except Exception:
-    st.error("Error loading dataset.")
-    st.stop()
+DATA_PATH = "NR_dataset.xlsx"
 
-# Normalize column names
-df.columns = (
-    df.columns.str.strip()
-    .str.lower()
-    .str.replace(" ", "_", regex=False)
-)
+# The Rust-based calamine reader parses XLSX several times faster than openpyxl
+# with far less peak memory; fall back to openpyxl where it isn't installed.
+EXCEL_ENGINE = "calamine" if find_spec("python_calamine") else "openpyxl"
 
 required_fields = [
     "label",
@@ -39,26 +36,167 @@ required_fields = [
     "retailchannel",
 ]
 
-missing_fields = [col for col in required_fields if col not in df.columns]
+# Low-cardinality columns used for filtering and grouping
+category_fields = [
+    "label",
+    "customerregion",
+    "productcategory",
+    "retailchannel",
+    "customeragegroup",
+    "customergender",
+]
+
+# Schema metadata key recording which workbook a Parquet copy was built from
+PARQUET_SOURCE_KEY = b"novaretail_source"
+
+# Text columns held as Arrow-backed strings rather than Python objects
+string_fields = ["transactionid"] + category_fields
+
+
+class MissingFieldsError(Exception):
+    def __init__(self, missing, columns):
+        super().__init__(missing)
+        self.missing = missing
+        self.columns = columns
+
+
+def parquet_source_tag(path, mtime, size):
+    # Everything the cleaned frame depends on: the workbook's identity and this
+    # script (so a change to the cleaning below also rebuilds the copy).
+    return json.dumps(
+        {
+            "path": os.path.abspath(path),
+            "mtime": mtime,
+            "size": size,
+            "script_mtime": os.path.getmtime(__file__),
+        }
+    ).encode()
+
+
+def read_parquet_copy(parquet_path, source_tag):
+    # Only an exact match is trusted: a workbook swapped for an older-dated
+    # file, or a copy half-written or damaged, is re-parsed from Excel.
+    try:
+        metadata = pq.read_schema(parquet_path).metadata or {}
+        if metadata.get(PARQUET_SOURCE_KEY) != source_tag:
+            return None
+        return pq.read_table(parquet_path).to_pandas()
+    except Exception:
+        return None
+
+
+def write_parquet_copy(table, parquet_path):
+    # Written beside the target and moved into place, so a concurrent reader
+    # or an interrupted run never sees a partial file.
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=os.path.basename(parquet_path) + ".",
+            suffix=".tmp",
+            dir=os.path.dirname(os.path.abspath(parquet_path)),
+        )
+        with os.fdopen(fd, "wb") as f:
+            pq.write_table(table, f)
+        os.replace(tmp_path, parquet_path)
+    except OSError:
+        # The Parquet copy is only a speed-up; on a read-only checkout the
+        # next cold start simply re-parses the workbook.
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Served as a shared resource rather than cache_data, which would unpickle a
+# full copy of the frame on every rerun. Nothing downstream mutates it, and the
+# stages below are keyed on data_version rather than on its contents. Only the
+# current workbook version is kept.
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_data(path, mtime, size):
+    # Reruns hit the cache. A cold start reads the already-cleaned frame from a
+    # Parquet copy tagged with the workbook it was built from.
+    parquet_path = os.path.splitext(path)[0] + ".parquet"
+    source_tag = parquet_source_tag(path, mtime, size)
+    data = read_parquet_copy(parquet_path, source_tag)
+    if data is not None:
+        return data
 
-if missing_fields:
-    st.error(f"Missing required logical fields: {missing_fields}")
-    st.write(df.columns)
-    st.stop()
+    # Every sheet column is kept: the required ones drive the dashboard and the
+    # rest are still shown in the Filtered Dataset table.
+    data = pd.read_excel(path, engine=EXCEL_ENGINE)
+
+    # Normalize column names
+    data.columns = [str(col).strip().lower().replace(" ", "_") for col in data.columns]
+
+    # A field is taken under its exact name when the sheet has it. Otherwise it
+    # is matched ignoring underscores ("Customer ID" -> "customer_id" still
+    # resolves to "customerid"). Only fields without an exact column are
+    # renamed, so a rename never lands on a name that is already taken.
+    present = set(data.columns)
+    columns_by_key = {col.replace("_", ""): col for col in data.columns}
+    unmatched = [col for col in required_fields if col not in present]
+    missing_fields = [col for col in unmatched if col not in columns_by_key]
+    if missing_fields:
+        raise MissingFieldsError(missing_fields, data.columns)
+    data = data.rename(columns={columns_by_key[col]: col for col in unmatched})
+
+    # Type conversions
+    data["transactiondate"] = pd.to_datetime(data["transactiondate"], errors="coerce")
+    # float32 halves the bytes every aggregation scans. The KPI sums and means
+    # below accumulate in float64 to avoid drift over many rows, but the stored
+    # values are already rounded, so a displayed average can differ by a cent.
+    data["purchaseamount"] = pd.to_numeric(data["purchaseamount"], errors="coerce", downcast="float")
+    data["customersatisfaction"] = pd.to_numeric(data["customersatisfaction"], errors="coerce", downcast="float")
+
+    data = data.dropna(subset=["purchaseamount"], ignore_index=True)
+
+    data = data.astype({col: "string[pyarrow]" for col in string_fields})
+
+    # Categories are built after the drop so they only list values that can
+    # actually be selected.
+    for col in category_fields:
+        data[col] = data[col].astype("category")
+    # Transaction ids are only ever counted; codes make that an integer pass.
+    data["transactionid"] = data["transactionid"].astype("category")
+
+    try:
+        table = pa.Table.from_pandas(data, preserve_index=False)
+    except (pa.ArrowException, ValueError, TypeError):
+        # An extra sheet column Arrow can't store: no copy, Excel every time.
+        return data
+    table = table.replace_schema_metadata({**table.schema.metadata, PARQUET_SOURCE_KEY: source_tag})
+    write_parquet_copy(table, parquet_path)
 
-# Type conversions
-df["transactiondate"] = pd.to_datetime(df["transactiondate"], errors="coerce")
-df["purchaseamount"] = pd.to_numeric(df["purchaseamount"], errors="coerce")
-df["customersatisfaction"] = pd.to_numeric(df["customersatisfaction"], errors="coerce")
+    # Converted back from the same Arrow table a warm start reads, so both
+    # paths return identical dtypes (categories come back as plain str).
+    return table.to_pandas()
 
-df = df.dropna(subset=["purchaseamount"])
+
+try:
+    # Identifies this version of the dataset; every cache below is keyed on it
+    # instead of hashing the frames themselves.
+    stat = os.stat(DATA_PATH)
+    data_version = (DATA_PATH, stat.st_mtime, stat.st_size)
+    df = load_data(*data_version)
+except FileNotFoundError:
+    st.error("Dataset file not found in repository.")
+    st.stop()
+except MissingFieldsError as e:
+    st.error(f"Missing required logical fields: {e.missing}")
+    st.write(e.columns)
+    st.stop()
+except Exception:
+    st.error("Error loading dataset.")
+    st.stop()
 
 # -------------------- SIDEBAR FILTERS --------------------
 st.sidebar.header("Filters")
 
+# The option lists are the (sorted, unique) categories fixed at load time, so
+# they are read straight off the dtype: no row scan, and no per-rerun cache
+# lookup that would have to hash the whole frame.
+options_by_field = {col: df[col].cat.categories.tolist() for col in category_fields}
+
 def create_filter(column, label):
-    values = sorted(df[column].dropna().astype(str).unique())
-    options = ["All"] + values
+    options = ["All"] + options_by_field[column]
     return st.sidebar.multiselect(label, options, default=["All"])
 
 segment_filter = create_filter("label", "Customer Segment")
@@ -69,29 +207,84 @@ age_filter = create_filter("customeragegroup", "Customer Age Group")
 gender_filter = create_filter("customergender", "Customer Gender")
 
 # -------------------- FILTERING --------------------
-filtered_df = df.copy()
-
-def apply_filter(data, column, selected):
-    if "All" in selected:
-        return data
-    return data[data[column].astype(str).isin(selected)]
+# Every cached stage below keeps results for at most this many filter
+# combinations (least recently used evicted first), so a long-running server
+# doesn't accumulate one entry per selection ever made.
+CACHE_ENTRIES = 64
+
+def category_mask(column, selected):
+    # Translate the few selected labels to category codes once, then test the
+    # integer codes rather than the values of every row.
+    selected_codes = column.cat.categories.get_indexer(list(selected))
+    return np.isin(column.cat.codes.to_numpy(), selected_codes[selected_codes >= 0])
+
+# The leading underscore keeps Streamlit from hashing the frame; the dataset
+# version and the selections fully determine the result. Only the positions of
+# matching rows are returned (and cached): columns are gathered later, and only
+# the ones a given stage needs.
+@st.cache_data(show_spinner=False, max_entries=CACHE_ENTRIES)
+def filter_rows(_data, data_version, active_filters):
+    # AND the active filters into one mask in place rather than materializing
+    # an intermediate frame (or a stack of masks) per filter.
+    mask = np.ones(len(_data), dtype=bool)
+    for column, selected in active_filters:
+        mask &= category_mask(_data[column], selected)
+    return np.flatnonzero(mask)
+
+def take_rows(column, rows):
+    # One column of the filtered rows; rows=None means no filter is active
+    return column if rows is None else column.iloc[rows]
+
+selections = [
+    ("label", segment_filter),
+    ("customerregion", region_filter),
+    ("productcategory", category_filter),
+    ("retailchannel", channel_filter),
+    ("customeragegroup", age_filter),
+    ("customergender", gender_filter),
+]
+# Multiselects return lists; tuples keep the cache key hashable and stable.
+active_filters = tuple(
+    (column, tuple(selected)) for column, selected in selections if "All" not in selected
+)
 
-filtered_df = apply_filter(filtered_df, "label", segment_filter)
-filtered_df = apply_filter(filtered_df, "customerregion", region_filter)
-filtered_df = apply_filter(filtered_df, "productcategory", category_filter)
-filtered_df = apply_filter(filtered_df, "retailchannel", channel_filter)
-filtered_df = apply_filter(filtered_df, "customeragegroup", age_filter)
-filtered_df = apply_filter(filtered_df, "customergender", gender_filter)
+# With every filter on "All" (the initial render) the full frame is used as is,
+# skipping the mask build and the cache lookup entirely.
+row_ids = filter_rows(df, data_version, active_filters) if active_filters else None
+n_filtered = len(df) if row_ids is None else len(row_ids)
 
-if filtered_df.empty:
+if n_filtered == 0:
     st.warning("No data matches selected filters.")
     st.stop()
 
 # -------------------- KPIs --------------------
-total_revenue = filtered_df["purchaseamount"].sum()
-avg_purchase = filtered_df["purchaseamount"].mean()
-total_transactions = filtered_df["transactionid"].nunique()
-avg_satisfaction = filtered_df["customersatisfaction"].mean()
+# Cached and keyed like the other stages, so reruns with unchanged filters skip
+# the column gathers and reductions entirely.
+@st.cache_data(show_spinner=False, max_entries=CACHE_ENTRIES)
+def compute_kpis(_data, _rows, data_version, active_filters):
+    amounts = take_rows(_data["purchaseamount"], _rows).to_numpy()
+    total_revenue = amounts.sum(dtype=np.float64)
+    avg_purchase = total_revenue / len(amounts)
+
+    n_transaction_ids = len(_data["transactionid"].cat.categories)
+    if n_transaction_ids == len(_data):
+        # Every loaded row has its own transaction id, so no dedupe is needed
+        total_transactions = len(amounts)
+    else:
+        transaction_codes = take_rows(_data["transactionid"], _rows).cat.codes.to_numpy()
+        total_transactions = np.count_nonzero(
+            np.bincount(transaction_codes[transaction_codes >= 0], minlength=n_transaction_ids)
+        )
+
+    satisfaction = take_rows(_data["customersatisfaction"], _rows).to_numpy()
+    rated = satisfaction[~np.isnan(satisfaction)]
+    avg_satisfaction = rated.sum(dtype=np.float64) / len(rated) if len(rated) else np.nan
+
+    return total_revenue, avg_purchase, total_transactions, avg_satisfaction
+
+total_revenue, avg_purchase, total_transactions, avg_satisfaction = compute_kpis(
+    df, row_ids, data_version, active_filters
+)
 
 k1, k2, k3, k4 = st.columns(4)
 
@@ -101,111 +294,158 @@ k3.metric("Total Transactions", f"{int(total_transactions)}")
 k4.metric("Average Customer Satisfaction", f"{avg_satisfaction:.2f}" if not np.isnan(avg_satisfaction) else "N/A")
 
 # -------------------- AGGREGATIONS --------------------
-def grouped_revenue(data, group_col):
-    if group_col not in data.columns:
-        return pd.DataFrame()
-    result = (
-        data.dropna(subset=[group_col])
-        .groupby(group_col)["purchaseamount"]
-        .sum()
-        .reset_index()
+def revenue_frame(name, categories, totals, counts):
+    # Keep only categories that occur, matching groupby(observed=True)
+    observed = counts > 0
+    return pd.DataFrame({
+        name: categories[observed],
+        "purchaseamount": totals[observed],
+    })
+
+def grouped_revenue(column, amounts):
+    # Sum amounts per category by integer code in a single C loop (-1 marks a
+    # missing key).
+    codes = column.cat.codes.to_numpy()
+    present = codes >= 0
+    codes = codes[present]
+    n_categories = len(column.cat.categories)
+    return revenue_frame(
+        column.name,
+        column.cat.categories,
+        np.bincount(codes, weights=amounts[present], minlength=n_categories),
+        np.bincount(codes, minlength=n_categories),
     )
-    result = result.sort_values(by=group_col)
-    return result
-
-rev_segment = grouped_revenue(filtered_df, "label")
-rev_region = grouped_revenue(filtered_df, "customerregion")
-rev_channel = grouped_revenue(filtered_df, "retailchannel")
-rev_category = grouped_revenue(filtered_df, "productcategory")
-
-seg_channel = (
-    filtered_df.dropna(subset=["label", "retailchannel"])
-    .groupby(["label", "retailchannel"])["purchaseamount"]
-    .sum()
-    .reset_index()
+
+def segment_channel_revenue(labels, channels, amounts):
+    # One pass fills a segment x channel revenue grid whose first row/column
+    # collect missing keys (code -1 shifted to 0). The segment and channel
+    # breakdowns are its margins, so they need no scans of their own.
+    n_labels = len(labels.cat.categories) + 1
+    n_channels = len(channels.cat.categories) + 1
+    cells = (
+        (labels.cat.codes.to_numpy().astype(np.intp) + 1) * n_channels
+        + channels.cat.codes.to_numpy() + 1
+    )
+    shape = (n_labels, n_channels)
+    totals = np.bincount(cells, weights=amounts, minlength=n_labels * n_channels).reshape(shape)
+    counts = np.bincount(cells, minlength=n_labels * n_channels).reshape(shape)
+
+    rev_segment = revenue_frame(
+        labels.name, labels.cat.categories, totals[1:].sum(axis=1), counts[1:].sum(axis=1)
+    )
+    rev_channel = revenue_frame(
+        channels.name, channels.cat.categories, totals[:, 1:].sum(axis=0), counts[:, 1:].sum(axis=0)
+    )
+    label_idx, channel_idx = np.nonzero(counts[1:, 1:])
+    seg_channel = pd.DataFrame({
+        labels.name: labels.cat.categories[label_idx],
+        channels.name: channels.cat.categories[channel_idx],
+        "purchaseamount": totals[1:, 1:][label_idx, channel_idx],
+    })
+    # The heatmap matrix is the grid itself, trimmed to segments and channels
+    # that occur; combinations without rows are already 0, as pivot + fillna(0)
+    # would have made them.
+    rows = np.isin(np.arange(n_labels - 1), label_idx)
+    cols = np.isin(np.arange(n_channels - 1), channel_idx)
+    revenue_grid = pd.DataFrame(
+        totals[1:, 1:][np.ix_(rows, cols)],
+        index=pd.Index(labels.cat.categories[rows], name=labels.name),
+        columns=pd.Index(channels.cat.categories[cols], name=channels.name),
+    )
+    return rev_segment, rev_channel, seg_channel, revenue_grid
+
+# All revenue breakdowns come from one cached call, keyed like filter_rows() on
+# the dataset version and the active filters rather than on the data itself.
+@st.cache_data(show_spinner=False, max_entries=CACHE_ENTRIES)
+def aggregate_revenue(_data, _rows, data_version, active_filters):
+    amounts = take_rows(_data["purchaseamount"], _rows).to_numpy()
+    rev_segment, rev_channel, seg_channel, revenue_grid = segment_channel_revenue(
+        take_rows(_data["label"], _rows), take_rows(_data["retailchannel"], _rows), amounts
+    )
+    return (
+        rev_segment,
+        grouped_revenue(take_rows(_data["customerregion"], _rows), amounts),
+        rev_channel,
+        grouped_revenue(take_rows(_data["productcategory"], _rows), amounts),
+        seg_channel,
+        revenue_grid,
+    )
+
+rev_segment, rev_region, rev_channel, rev_category, seg_channel, revenue_grid = aggregate_revenue(
+    df, row_ids, data_version, active_filters
 )
 
 # -------------------- VISUALIZATIONS --------------------
-if not rev_segment.empty:
-    fig1 = px.bar(
-        rev_segment,
-        x="label",
+# Figures are cached on the aggregated frames that feed them, so reruns with
+# unchanged data reuse the built figure instead of rebuilding its spec. Each
+# filter combination yields four bar charts, hence the larger bound.
+@st.cache_resource(show_spinner=False, max_entries=4 * CACHE_ENTRIES)
+def revenue_bar(data, x, x_label, title):
+    return px.bar(
+        data,
+        x=x,
         y="purchaseamount",
-        title="Revenue by Customer Segment",
-        labels={"label": "Customer Segment", "purchaseamount": "Revenue"},
+        title=title,
+        labels={x: x_label, "purchaseamount": "Revenue"},
         template="plotly_white"
     )
-    st.plotly_chart(fig1, use_container_width=True)
 
-if not rev_channel.empty:
-    fig2 = px.bar(
-        rev_channel,
-        x="retailchannel",
-        y="purchaseamount",
-        title="Revenue by Retail Channel",
-        labels={"retailchannel": "Retail Channel", "purchaseamount": "Revenue"},
+@st.cache_resource(show_spinner=False, max_entries=CACHE_ENTRIES)
+def revenue_heatmap(grid):
+    return px.imshow(
+        grid,
+        text_auto=".2f",
+        aspect="auto",
+        title="Revenue Heatmap: Customer Segment × Retail Channel",
+        labels=dict(x="Retail Channel", y="Customer Segment", color="Revenue"),
         template="plotly_white"
     )
+
+if not rev_segment.empty:
+    fig1 = revenue_bar(rev_segment, "label", "Customer Segment", "Revenue by Customer Segment")
+    st.plotly_chart(fig1, use_container_width=True)
+
+if not rev_channel.empty:
+    fig2 = revenue_bar(rev_channel, "retailchannel", "Retail Channel", "Revenue by Retail Channel")
     st.plotly_chart(fig2, use_container_width=True)
 
 if not rev_category.empty:
-    fig3 = px.bar(
-        rev_category,
-        x="productcategory",
-        y="purchaseamount",
-        title="Revenue by Product Category",
-        labels={"productcategory": "Product Category", "purchaseamount": "Revenue"},
-        template="plotly_white"
-    )
+    fig3 = revenue_bar(rev_category, "productcategory", "Product Category", "Revenue by Product Category")
     st.plotly_chart(fig3, use_container_width=True)
 
 if not rev_region.empty:
-    fig4 = px.bar(
-        rev_region,
-        x="customerregion",
-        y="purchaseamount",
-        title="Revenue by Customer Region",
-        labels={"customerregion": "Customer Region", "purchaseamount": "Revenue"},
-        template="plotly_white"
-    )
+    fig4 = revenue_bar(rev_region, "customerregion", "Customer Region", "Revenue by Customer Region")
     st.plotly_chart(fig4, use_container_width=True)
 
 if not seg_channel.empty:
-    pivot = seg_channel.pivot(index="label", columns="retailchannel", values="purchaseamount").fillna(0)
-    fig5 = px.imshow(
-        pivot,
-        text_auto=True,
-        aspect="auto",
-        title="Revenue Heatmap: Customer Segment × Retail Channel",
-        labels=dict(x="Retail Channel", y="Customer Segment", color="Revenue"),
-        template="plotly_white"
-    )
+    fig5 = revenue_heatmap(revenue_grid)
     st.plotly_chart(fig5, use_container_width=True)
 
 # -------------------- STRATEGIC INSIGHTS --------------------
 st.markdown("## Strategic Insights")
 
+def top_bottom(data, col="purchaseamount"):
+    # argmax/argmin on the raw array, then a positional lookup
+    values = data[col].to_numpy()
+    return data.iloc[values.argmax()], data.iloc[values.argmin()]
+
 top_segment = bottom_segment = None
 top_channel = bottom_channel = None
 strongest_combo = None
 
 if not rev_segment.empty:
-    top_segment = rev_segment.loc[rev_segment["purchaseamount"].idxmax()]
-    bottom_segment = rev_segment.loc[rev_segment["purchaseamount"].idxmin()]
+    top_segment, bottom_segment = top_bottom(rev_segment)
 
 if not rev_channel.empty:
-    top_channel = rev_channel.loc[rev_channel["purchaseamount"].idxmax()]
-    bottom_channel = rev_channel.loc[rev_channel["purchaseamount"].idxmin()]
+    top_channel, bottom_channel = top_bottom(rev_channel)
 
 if not seg_channel.empty:
-    strongest_combo = seg_channel.loc[seg_channel["purchaseamount"].idxmax()]
+    strongest_combo, _ = top_bottom(seg_channel)
 
-decline_revenue = 0
-decline_df = filtered_df[
-    filtered_df["label"].astype(str).str.strip().str.lower() == "decline"
-]
-if not decline_df.empty:
-    decline_revenue = decline_df["purchaseamount"].sum()
+# Decline revenue is already a row of the segment breakdown; matching there
+# touches a handful of segment names instead of every filtered row.
+is_decline = rev_segment["label"].astype(str).str.strip().str.lower() == "decline"
+decline_revenue = rev_segment.loc[is_decline.to_numpy(), "purchaseamount"].sum()
 
 if top_segment is not None:
     st.write(f"Highest revenue segment: {top_segment['label']}")
@@ -253,4 +493,24 @@ else:
 
 # -------------------- DISPLAY DATA --------------------
 st.markdown("## Filtered Dataset")
-st.dataframe(filtered_df.reset_index(drop=True))
+
+# Every row shipped here is serialized to Arrow and sent to the browser on each
+# rerun, so large selections are truncated unless explicitly requested.
+MAX_TABLE_ROWS = 2000
+
+show_all = n_filtered <= MAX_TABLE_ROWS or st.checkbox("Show all rows")
+n_shown = n_filtered if show_all else MAX_TABLE_ROWS
+
+# Full rows are only assembled for the part of the selection that is shown
+shown_rows = slice(0, n_shown) if row_ids is None else row_ids[:n_shown]
+st.dataframe(
+    df.iloc[shown_rows].reset_index(drop=True),
+    # The float32 columns are formatted as the workbook entered them, not as
+    # their nearest float32 value (349.99 rather than 349.989990234375).
+    column_config={
+        "purchaseamount": st.column_config.NumberColumn(format="%.2f"),
+        "customersatisfaction": st.column_config.NumberColumn(format="%d"),
+    },
+)
+if not show_all:
+    st.caption(f"Showing first {MAX_TABLE_ROWS:,} of {n_filtered:,} rows")